@@ -6,13 +6,21 @@ This needs to be subclassed to Electronics.Instruments.PowerMeter
 
 import logging
 import re
-import numpy as NP
+from time import time
 
 from Electronics.Interfaces.GPIB import Gpib
 from Electronics.Interfaces.GPIB.devices import pm
 
 module_logger = logging.getLogger(__name__)
 
+# GPIB status word (ibsta) bits, as in linux-gpib's ib.h
+RQS  = 0x0800 # device requesting service
+TIMO = 0x4000 # time limit exceeded
+
+# status message units (character 14) and relative mode (character 17)
+_STATUS_RE = re.compile(r"^.{14}(\d)(?:..(\d))?")
+_MODE = {'0':'W', '1':'dBm'} # keyed on units digit
+
 
 class PM(Gpib):
   """
@@ -43,6 +51,8 @@ class PM(Gpib):
   max_settling_time = {1:3.0, 2:1.0, 3:0.15, 4:0.10, 5:0.10} # seconds vs range
   sampling_rate = {1:20, 2:2} # samples/sec for 1 or 2 channels
   power_range_filter = {1:7, 2:3, 3:1, 4:0, 5:0}
+  zero_done_mask = 0x02 # status byte bit for cal/zero completed
+  zero_time = 30.0 # seconds to wait for a zero to complete
   def __init__(self, name, pm_type=None, timeout=10000):
     """
     @type name : str
@@ -59,6 +69,15 @@ class PM(Gpib):
       pm_type = pm[devID]['type']
     self.name = name
     self.pm_type = pm_type
+    # the model never changes so work out the command family once
+    self._is_436 = "436" in pm_type
+    self._is_437_438 = "437" in pm_type or "438" in pm_type
+    self._is_scpi = "E4418" in pm_type
+    # a 437 or 438 can signal the end of a zero if the GPIB class can wait
+    # for the service request and serial poll the meter
+    self._use_srq = self._is_437_438 and hasattr(self, "wait") and \
+                    hasattr(self, "rsp") and hasattr(self, "ibsta")
+    self._mode_cache = None
     self.init()
 
   def init(self):
@@ -72,8 +91,7 @@ class PM(Gpib):
      - manual filter 5
      - resolution 0.01% of full scale
     """
-    if re.search("437", self.pm_type) or \
-       re.search("438", self.pm_type):
+    if self._is_437_438:
       #           |||--------------------- disable limits checking
       #           |  ||------------------- linear
       #           |  | ||------------------sensor A
@@ -83,6 +101,7 @@ class PM(Gpib):
       #           |  | | |  |   |    |||** REF cal factor
       #           |  | | |  |   |    |     res. .01% of full scale
       self.write("LM0LNAPTR3RAENFM5ENRE3EN\r\n")
+      self.invalidate_mode()
       self.filtercode = 5
       self.num_averages = self._n_avgs_()
       self.mode = 'LN'
@@ -91,6 +110,55 @@ class PM(Gpib):
 
   def _n_avgs_(self):
     return 2**self.filtercode
+
+  def _wait_for_zero_(self):
+    """
+    Wait for a zero started with ZE to finish
+
+    If the status byte mask has been set for it, the 437 and 438 request
+    service when zeroing completes so the bus is left alone until then.
+    Otherwise the status message is polled with a short time-out.
+
+    Raises RuntimeError if the zero does not finish within zero_time.
+    """
+    if self._use_srq:
+      self.tmo(int(1000*self.zero_time))
+      try:
+        status = self.wait(RQS | TIMO)
+        if status is None:
+          # linux-gpib's Gpib.wait does not return the status word
+          status = self.ibsta()
+      finally:
+        self.tmo(500)
+      if not status & RQS:
+        module_logger.error("PM._wait_for_zero_: no SRQ from %s in %g s",
+                            self.name, self.zero_time)
+        raise RuntimeError("zeroing %s timed out" % self.name)
+      # the serial poll clears the service request
+      self.rsp()
+    else:
+      # poll with a short time-out; a meter too busy to answer is still zeroing
+      deadline = time() + self.zero_time
+      self.tmo(50)
+      try:
+        while True:
+          if time() > deadline:
+            module_logger.error("PM._wait_for_zero_: %s not zeroed in %g s",
+                                self.name, self.zero_time)
+            raise RuntimeError("zeroing %s timed out" % self.name)
+          self.write("SM")
+          try:
+            response = self.read()
+          except Exception:
+            if hasattr(self, "ibsta") and not self.ibsta() & TIMO:
+              # not a time-out
+              raise
+            continue
+          # a truncated status message says nothing about the zero
+          if len(response) >= 6 and response[4:6] != "06":
+            break
+      finally:
+        self.tmo(500)
     
   def get_readings(self,num):
     """
@@ -99,20 +167,47 @@ class PM(Gpib):
     @param num : number of readings
     @type num : int
 
-    @return: a list of loats
+    @return: (list of floats, mode)
     """
     self.clear()
 
-    self.mode = self.get_mode()
-    readings = []
-    for i in range(0,num):
-      try:
-        readings.append( float(self.read().strip()) )
-      except:
-        module_logger.error("PM.get_readings: Invalid reading #%d from PM", i)
-        readings.append(0)
-      if i < num-1:
-        sleep(0.5)
+    if self._mode_cache is None:
+      self._mode_cache = self.get_mode()
+    self.mode = self._mode_cache
+    # the 437 and 438 can be triggered on demand so that each reading is
+    # taken when asked for; other types are read in free run
+    if self._is_437_438:
+      # trigger hold
+      self.write("TR0")
+    # invalid readings are left as 0
+    readings = [0.0]*num
+    read = self.read
+    error = module_logger.error
+    try:
+      if self._is_437_438 and num > 0:
+        # trigger immediate; the meter returns one reading per trigger
+        # each time it is addressed to talk, so triggers cannot be batched
+        self.write("TR1")
+      for i in range(0,num):
+        try:
+          response = read()
+        except Exception, details:
+          error("PM.get_readings: reading #%d from PM failed: %s", i, details)
+          response = None
+        if self._is_437_438 and i < num-1:
+          # trigger the next reading before converting this one; nothing is
+          # left pending after the last
+          self.write("TR1")
+        if response is not None:
+          try:
+            readings[i] = float(response.strip())
+          except ValueError:
+            error("PM.get_readings: Invalid reading #%d from PM: %r",
+                  i, response)
+    finally:
+      if self._is_437_438:
+        # never leave the meter in trigger hold
+        self.write("TR3")
     return readings,self.mode
 
   def get_average(self,num):
@@ -122,10 +217,12 @@ class PM(Gpib):
     @param num : number of readings
     @type num : int
 
-    @return: float
+    @return: float (nan if num is not positive)
     """
+    if num <= 0:
+      return float('nan')
     readings = self.get_readings(num)[0]
-    return NP.mean(NP.array(readings))
+    return sum(readings)/len(readings)
 
   def get_mode(self):
     """
@@ -134,9 +231,7 @@ class PM(Gpib):
     @return: str
     """
     module_logger.debug("PM.get_mode: entered")
-    if re.search('437', self.pm_type) or \
-       re.search('438', self.pm_type) or \
-       re.search('E4418', self.pm_type):
+    if self._is_437_438 or self._is_scpi:
       try:
         self.write("SM")
       except:
@@ -153,24 +248,23 @@ class PM(Gpib):
       module_logger.error("PM.get_mode: Unknown power meter type %s",self.pm_type)
       return None
     # This returns a string something like this: 000000151105170A0002000
-    if len(response) >= 15:
-      units = int(response[14])
-    else:
-      units = -1
-    if units == 0:
-      mode = 'W'
-    elif units == 1:
-      mode = 'dBm'
-    else:
-      mode = '?'
-    if len(response) >= 18:
-      rel_mode = response[17]
-    else:
-      rel_mode = -1
-    if rel_mode > 0:
+    m = _STATUS_RE.match(response)
+    if m is None:
+      return '?'
+    mode = _MODE.get(m.group(1), '?')
+    if m.group(2) not in (None, '0'):
       mode += " rel"
     return mode
 
+  def invalidate_mode(self):
+    """
+    Forget the cached reading mode
+
+    This must be called if the mode is changed other than through this
+    class, for example from the front panel.
+    """
+    self._mode_cache = None
+
   def set_mode(self,mode):
     """
     Set the power meter mode
@@ -181,22 +275,20 @@ class PM(Gpib):
     @return: None
     """
     if mode == "W":
-      if re.search("436", self.pm_type):
+      if self._is_436:
         self.write("9A+V")
-      elif re.search("437", self.pm_type) or \
-          re.search("438", self.pm_type) or \
-          re.search("E4418", self.pm_type):
+      elif self._is_437_438 or self._is_scpi:
         self.write("LN")
       self.mode = "W"
     else:
       # must be dBm mode instead
-      if re.search("436", self.pm_type):
+      if self._is_436:
         self.write("9D+V")
-      elif re.search("437", self.pm_type) or \
-          re.search("438", self.pm_type) or \
-          re.search("E4418", self.pm_type):
+      elif self._is_437_438 or self._is_scpi:
         self.write("LG")
       self.mode = "dBm"
+    # read the mode back next time; relative mode may still be on
+    self.invalidate_mode()
 
   def configure(self):
     """
@@ -234,21 +326,20 @@ class PM(Gpib):
 
     @param FE : front-end with amplifier to be turned off
     @type FE : front end instance
+
+    @raise RuntimeError : the zero did not finish within zero_time
     """
-    if re.search('436', self.pm_type):
-      # see below for the configuration codes
-      self.write("LM0LNTR3RM1ENFM5EN")
-      # send the zero command
-      self.write("ZEEN")
-      # wait for done
-      status = "06"
-      while status == "06":
-        self.write("SM")
-        status = self.read()[4:6]
-      # restore configuration; this only changes the ranging
-      self.write("LM0LNTR3RM4ENFM5EN")
-    elif re.search('437', self.pm_type) or \
-       re.search('438', self.pm_type):
+    if self._is_436:
+      # see below for the configuration codes; ZEEN sends the zero command
+      self.write("LM0LNTR3RM1ENFM5ENZEEN")
+      try:
+        # wait for done
+        self._wait_for_zero_()
+      finally:
+        # restore configuration; only the ranging was changed
+        self.write("RM4EN")
+        self.invalidate_mode()
+    elif self._is_437_438:
       # configure for zeroing:
       #  LM0 -disable limit checking
       #  LN - linear mode
@@ -256,15 +347,23 @@ class PM(Gpib):
       #  TR3 - free run
       #  RM1EN - manual ranging 1
       #  FM5EN - manual filter 5
-      self.write("LM0LNAPTR3RM1ENFM5EN")
+      setup = "LM0LNAPTR3RM1ENFM5EN"
+      # zeroing only changes the zero offset so only the ranging needs
+      # resetting afterwards
+      restore = "RM4EN"
+      if self._use_srq:
+        # request service when the zero is done and clear the mask after
+        # restoring; the clear goes last since its mask byte is a NUL
+        setup += "@1"+chr(self.zero_done_mask)
+        restore += "@1"+chr(0)
       # send the zero command
-      self.write("ZEEN")
-      # wait for done
-      status = "06"
-      while status == "06":
-        self.write("SM")
-        status = self.read()[4:6]
-      # restore configuration
-      self.write("LM0LNAPTR3RM4ENFM5EN")
+      self.write(setup + "ZEEN")
+      try:
+        # wait for done
+        self._wait_for_zero_()
+      finally:
+        # restore configuration
+        self.write(restore)
+        self.invalidate_mode()
     else:
       pass
@@ -7,13 +7,39 @@ Monitor and control of commercial instruments
 from Electronics.Interfaces.GPIB import Gpib
 from Electronics.Interfaces.GPIB.devices import pm
 
-import re
-from time import sleep, ctime, time
-import numpy as NP
+from multiprocessing.pool import ThreadPool
+from time import ctime, time
 import logging
 
+from .HP43x import PM
+
 module_logger = logging.getLogger(__name__)
 
+def get_readings_many(meters, num):
+  """
+  Get a number of readings from several power meters at once
+
+  Each meter is read in its own thread.  Meters on separate GPIB interfaces
+  are read fully in parallel.  Meters sharing one GPIB board still take turns
+  on the bus, so only the time they spend measuring overlaps.
+
+  @param meters : power meters
+  @type meters : list of PM instances
+
+  @param num : number of readings from each meter
+  @type num : int
+
+  @return: list of (readings, mode) in the order of meters
+  """
+  if not meters:
+    return []
+  pool = ThreadPool(len(meters))
+  try:
+    return pool.map(lambda meter: meter.get_readings(num), meters)
+  finally:
+    pool.close()
+    pool.join()
+
 
 class SG(Gpib):
   """  
@@ -30,6 +56,10 @@ class SG(Gpib):
   =================
   ID - identification
 """
+  # command templates; %s keeps the full precision of str()
+  freq_cmd = "FREQ:CW %s HZ"
+  ampl_cmd = "POW:AMPL %s DBM"
+
   def __init__(self, ID):
     Gpib.__init__(self, ID)
     self.ID = ID
@@ -46,65 +76,63 @@ class SG(Gpib):
     #Wait for 2 sec before passing next command
     #sleep(2)
     #self.write("*CLS")
-    print "Signal Generator has been reset"
+    module_logger.info("SG.init: signal generator has been reset")
 
   # Turn RF ON
   def power_on(self):
     self.write(":RF1")
-    print "RF turned ON"
+    module_logger.info("SG.power_on: RF turned ON")
   
   #Turn RF OFF
   def power_off(self):
     self.write(":RF0")
-    print "RF turned OFF"
+    module_logger.info("SG.power_off: RF turned OFF")
 
   # Set Frequency
   def set_freq(self,freq):
     # Frequency between 2.0 to 26.0 GHz in either MHz, KHz or Hz
-    self.write("FREQ:CW "+ str(freq) +" HZ")
-    print "Frequency set to ", freq     
+    self.write(self.freq_cmd % freq)
+    module_logger.info("SG.set_freq: frequency set to %s", freq)
  
   #Set Amplitude
   def set_ampl(self,num):
     #WARNING: Enter Amplitude in dBm only and not more that "0dBm" !!!
-    self.write("POW:AMPL "+ str(num) +" DBM")
-    print "Amplitude set to ", num, "dBm" 
+    self.write(self.ampl_cmd % num)
+    module_logger.info("SG.set_ampl: amplitude set to %s dBm", num)
 
   #Get the device identification, FRQ, RF status, AMPL
   def get_status(self):
     try:
-      #Wait 1 sec between each command
-      sleep(1)
+      # Each query is read back before the next is sent, so no pacing is
+      # needed between commands.
       # Query commands in this section are not functioning.
       # Need to look for the right GPIB commands.
       self.write("*IDN?")
-      print "SigGen", self.read(), "identified" 
+      module_logger.info("SG.get_status: SigGen %s identified", self.read())
     except:
-      print "SigGen",self.ID,"identification failed"
+      module_logger.error("SG.get_status: SigGen %s identification failed",
+                          self.ID)
       return None
     
     try:
-      sleep(1)
       self.write("OUTP:STAT?")
-      print "RF is", self.read()
+      module_logger.info("SG.get_status: RF is %s", self.read())
     except:
-      print "RF status request failed"
+      module_logger.error("SG.get_status: RF status request failed")
       return None
     
     try:
-      sleep(1)
       self.write("FREQ:CW?")
-      print "Sig Gen frequency is set to", self.read()
+      module_logger.info("SG.get_status: frequency is set to %s", self.read())
     except:
-      print "Sig Gen frequency request failed"
+      module_logger.error("SG.get_status: frequency request failed")
       return None
     
     try:
-      sleep(1)
       self.write("POW:AMPL?")
-      print "Amplitude is set to", self.read()
+      module_logger.info("SG.get_status: amplitude is set to %s", self.read())
     except:
-      print "Sig Gen amplitude request failed"
+      module_logger.error("SG.get_status: amplitude request failed")
       return None
     
  